@@ -4,6 +4,7 @@ from flask import Flask, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user
 from sqlalchemy.orm import DeclarativeBase
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -26,15 +27,46 @@ def create_app():
     }
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
     app.config['UPLOAD_FOLDER'] = '/tmp'  # Temporary storage
+    app.config['ASGI_WORKER_THREADS'] = int(os.environ.get('ASGI_WORKER_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+
+    # Authentication
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['AUTH_HASH_WORKERS'] = int(os.environ.get('AUTH_HASH_WORKERS', 2))  # Concurrent hash jobs
+    app.config['AUTH_HASH_QUEUE'] = int(os.environ.get('AUTH_HASH_QUEUE', 8))  # Waiting jobs before 503
+    app.config['AUTH_MAX_FAILURES'] = int(os.environ.get('AUTH_MAX_FAILURES', 5))
+    app.config['AUTH_FAILURE_WINDOW'] = int(os.environ.get('AUTH_FAILURE_WINDOW', 15 * 60))
+    app.config['AUTH_THROTTLE_MAX_IPS'] = 10000
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))  # Hops to trust X-Forwarded-For from
+
+    # Result storage and cleanup
+    app.config['STORAGE_ROOT'] = os.environ.get('STORAGE_ROOT', os.path.join(app.config['UPLOAD_FOLDER'], 'pdf9'))
+    app.config['STORAGE_USER_QUOTA'] = int(os.environ.get('STORAGE_USER_QUOTA', 100 * 1024 * 1024))  # 100MB per user
+    app.config['STORAGE_GLOBAL_QUOTA'] = int(os.environ.get('STORAGE_GLOBAL_QUOTA', 2 * 1024 * 1024 * 1024))  # 2GB
+    app.config['STORAGE_TTL'] = int(os.environ.get('STORAGE_TTL', 24 * 60 * 60))  # Keep results for a day
+    app.config['STORAGE_REAPER_INTERVAL'] = int(os.environ.get('STORAGE_REAPER_INTERVAL', 10 * 60))  # 0 disables
+    app.config['STORAGE_HISTORY_RETENTION_DAYS'] = int(os.environ.get('STORAGE_HISTORY_RETENTION_DAYS', 90))
+
+    # Page previews
+    app.config['THUMBNAIL_WIDTH'] = 160
+    app.config['THUMBNAIL_MEMORY_CACHE'] = int(os.environ.get('THUMBNAIL_MEMORY_CACHE', 32 * 1024 * 1024))  # 32MB
+    app.config['THUMBNAIL_WORKERS'] = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+    app.config['THUMBNAIL_PREFETCH_PAGES'] = int(os.environ.get('THUMBNAIL_PREFETCH_PAGES', 24))  # Beyond the visible ones
+
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 
     # Initialize extensions
     db.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
 
+    from security import password_hasher, login_throttle
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
+
     with app.app_context():
         # Import models
-        from models import User, PDFFile
+        from models import User, PDFFile, UsageDaily
 
         # Import blueprints
         from blueprints.auth import auth_bp
@@ -49,6 +81,13 @@ def create_app():
         # Create database tables
         db.create_all()
 
+        # Start result storage and its reaper once the tables exist
+        from storage import storage
+        storage.init_app(app)
+
+        from thumbnails import thumbnails
+        thumbnails.init_app(app)
+
         # Root route
         @app.route('/')
         def index():
@@ -0,0 +1,285 @@
+import sys
+import asyncio
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+# Request bodies larger than this spill from memory to a temp file
+SPOOL_SIZE = 1024 * 1024
+
+# Response chunks a view may run ahead of the client before it has to wait
+RESPONSE_BUFFER_CHUNKS = 16
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class AsyncWSGIAdapter:
+    """Serve the Flask app over ASGI without tying a thread to each socket.
+
+    The request body is received on the event loop and spooled before the
+    app runs, and the app's response is pushed onto a queue that the event
+    loop drains to the client at whatever pace it reads. A worker thread is
+    therefore only busy while the view itself is running, and slow uploads
+    or downloads cost a coroutine rather than a thread. The queue holds at
+    most RESPONSE_BUFFER_CHUNKS chunks, so a slow reader holds back the view
+    instead of the whole response piling up in memory. If the client goes
+    away the view's iterator is closed early, so generator cleanup runs.
+    """
+
+    def __init__(self, wsgi_app, max_workers=None, max_body=None, spool_dir=None, dedicated=None):
+        self.wsgi_app = wsgi_app
+        self.max_body = max_body
+        self.spool_dir = spool_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi-worker')
+
+        # Path prefixes that get a pool of their own, so a burst on one of
+        # them can't queue up ahead of everything else
+        self.dedicated = [
+            (prefix, ThreadPoolExecutor(max_workers=workers, thread_name_prefix='asgi-' + prefix.strip('/')))
+            for prefix, workers in (dedicated or {}).items()
+        ]
+
+    def _executor_for(self, path):
+        for prefix, executor in self.dedicated:
+            if path.startswith(prefix):
+                return executor
+        return self.executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        received = await self._receive_body(scope, receive, send)
+        if received is None:
+            return
+        body, size = received
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        slots = threading.Semaphore(RESPONSE_BUFFER_CHUNKS)
+        gone = threading.Event()
+        environ = self._build_environ(scope, body, size)
+        executor = self._executor_for(scope['path'])
+        worker = loop.run_in_executor(executor, self._run_wsgi, environ, loop, queue, slots, gone)
+
+        try:
+            await self._send_response(queue, send, receive, slots)
+        finally:
+            # Harmless once the response is complete; otherwise it stops the
+            # view, waking it if it is waiting for buffer space
+            gone.set()
+            slots.release()
+            await worker
+            body.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                for _, executor in self.dedicated:
+                    executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _receive_body(self, scope, receive, send):
+        """Spool the request body without blocking and return (file, size).
+
+        Returns None after replying itself if the body is too large or the
+        client disconnects.
+        """
+        headers = dict(scope['headers'])
+        declared = headers.get(b'content-length')
+        if self.max_body and declared and declared.isdigit() and int(declared) > self.max_body:
+            await self._send_error(send, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return None
+
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=self.spool_dir)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body and size > self.max_body:
+                body.close()
+                await self._send_error(send, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                return None
+            body.write(chunk)
+
+            if not message.get('more_body', False):
+                break
+
+        body.seek(0)
+        return body, size
+
+    def _build_environ(self, scope, body, size):
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in scope['headers']:
+            name = name.decode('latin-1')
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                continue
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _run_wsgi(self, environ, loop, queue, slots, gone):
+        """Runs in a worker thread. Waits only for buffer space, and stops
+        as soon as gone is set."""
+        def put(item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+            return write
+
+        def ensure_started():
+            if not response.get('sent'):
+                response['sent'] = True
+                put(('start', response['status'], response['headers']))
+
+        def write(data):
+            ensure_started()
+            slots.acquire()
+            if gone.is_set():
+                raise ClientDisconnected()
+            put(('body', bytes(data)))
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if gone.is_set():
+                        raise ClientDisconnected()
+                    if chunk:
+                        write(chunk)
+                ensure_started()
+            finally:
+                # Closing runs the finally blocks of generator responses
+                if hasattr(result, 'close'):
+                    result.close()
+        except ClientDisconnected:
+            logger.info(f"Client disconnected, stopped {environ['PATH_INFO']}")
+        except Exception as e:
+            logger.exception("Unhandled error in WSGI app")
+            put(('error', e))
+        finally:
+            put(('end',))
+
+    async def _send_response(self, queue, send, receive, slots):
+        """Send queued items until the response ends or the client leaves.
+
+        uvicorn silently drops sends once the client has gone, so the
+        disconnect is watched for on receive() alongside the queue.
+        """
+        started = False
+        disconnect = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                await asyncio.wait({get, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnect.done():
+                    get.cancel()
+                    logger.info("Client disconnected during response")
+                    return
+                item = get.result()
+                if item[0] == 'start':
+                    await send({'type': 'http.response.start', 'status': item[1], 'headers': item[2]})
+                    started = True
+                elif item[0] == 'body':
+                    await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+                    slots.release()
+                elif item[0] == 'error':
+                    if not started:
+                        await self._send_error(send, HTTPStatus.INTERNAL_SERVER_ERROR)
+                    return
+                else:
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                    return
+        except OSError:
+            logger.info("Client disconnected during response")
+        finally:
+            disconnect.cancel()
+
+    async def _wait_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def _send_error(self, send, status):
+        body = status.phrase.encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status.value,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def create_asgi_app(app=None):
+    """ASGI entry point, e.g. `uvicorn --factory asgi:create_asgi_app`."""
+    if app is None:
+        from app import create_app
+        app = create_app()
+    # Auth threads mostly wait on the password hasher. Allow more of them
+    # than the hasher has slots so overflow is shed with a quick 503.
+    auth_threads = 2 * (app.config['AUTH_HASH_WORKERS'] + app.config['AUTH_HASH_QUEUE'])
+    return AsyncWSGIAdapter(
+        app,
+        max_workers=app.config['ASGI_WORKER_THREADS'],
+        max_body=app.config['MAX_CONTENT_LENGTH'],
+        spool_dir=app.config['UPLOAD_FOLDER'],
+        dedicated={'/auth/': auth_threads}
+    )
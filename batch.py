@@ -0,0 +1,192 @@
+import os
+import json
+import logging
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.utils import secure_filename
+import pdf_ops
+
+logger = logging.getLogger(__name__)
+
+# Operations that apply independently to each file of a batch
+BATCH_OPERATIONS = {
+    'compress': pdf_ops.compress,
+    'optimize': pdf_ops.optimize,
+    'watermark': pdf_ops.watermark,
+    'rotate': pdf_ops.rotate,
+    'split': pdf_ops.split,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _mp_context():
+    # Workers are forked so they don't re-run the app's startup code; they
+    # only ever execute the pure functions in pdf_ops.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+
+def get_pool():
+    """Process pool shared by all batches, sized to the machine and created
+    on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_mp_context())
+        return _pool
+
+
+def reset_pool(broken):
+    """Drop the shared pool, but only if it is still the one that broke; a
+    request that saw an old pool fail must not tear down its replacement."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def process_file(operation, data, options):
+    """Runs in a worker: returns (output bytes, None) or (None, error)."""
+    try:
+        return BATCH_OPERATIONS[operation](data, **options), None
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+
+
+def process_isolated(operation, data, options):
+    """Run one input in a single-use worker, so if it crashes the process
+    nothing else is lost with it."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=_mp_context()) as pool:
+        return pool.submit(process_file, operation, data, options).result()
+
+
+class ZipStream:
+    """Write-only file object that hands back whatever zipfile wrote so far."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def unique_names(filenames, suffix):
+    """Safe, unique archive names for the uploaded files."""
+    seen = set()
+    names = []
+    for index, filename in enumerate(filenames, 1):
+        base = os.path.splitext(secure_filename(filename or ''))[0] or f'file_{index}'
+        name = f'{base}_{suffix}.pdf'
+        counter = 1
+        while name in seen:
+            counter += 1
+            name = f'{base}_{suffix}_{counter}.pdf'
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def run_batch(operation, files, options, on_complete=None):
+    """Process (filename, data) pairs in parallel and yield a ZIP as it fills.
+
+    Each output is added to the archive as soon as its worker finishes. A
+    file that fails only gets an error entry in manifest.json, which is
+    written last and lists the status of every input. If a worker process
+    dies it takes everything queued on the shared pool with it, so the
+    unfinished inputs are rerun one per process and only the one that
+    crashes again is marked failed. on_complete is called with the manifest
+    and the archive size once the archive is closed, or with what was sent
+    so far if the client goes away first.
+    """
+    names = unique_names([filename for filename, _ in files], operation)
+    manifest = [{'file': filename, 'output': None, 'status': 'pending'} for filename, _ in files]
+
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED)
+
+    pending = list(range(len(files)))
+    futures = {}
+    isolator = None
+    try:
+        while pending:
+            futures = {}
+            if isolator is None:
+                pool = get_pool()
+                try:
+                    for index in pending:
+                        futures[pool.submit(process_file, operation, files[index][1], options)] = index
+                except BrokenProcessPool as e:
+                    logger.error(f"Batch pool unavailable: {str(e)}")
+                    reset_pool(pool)
+                    isolator = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+                    continue
+            else:
+                for index in pending:
+                    futures[isolator.submit(process_isolated, operation, files[index][1], options)] = index
+
+            retry = []
+            for future in as_completed(futures):
+                index = futures[future]
+                entry = manifest[index]
+                try:
+                    output, error = future.result()
+                except BrokenProcessPool as e:
+                    if isolator is None:
+                        # Some input on the shared pool crashed its worker;
+                        # rerun every unfinished one in a process of its own
+                        reset_pool(pool)
+                        retry.append(index)
+                        continue
+                    output, error = None, f'Worker crashed: {str(e)}'
+                except Exception as e:
+                    output, error = None, str(e)
+
+                if error is None:
+                    entry.update(status='completed', output=names[index], size=len(output))
+                    archive.writestr(names[index], output)
+                else:
+                    logger.error(f"Batch {operation} failed for {entry['file']}: {error}")
+                    entry.update(status='failed', error=error)
+                yield stream.drain()
+
+            pending = sorted(retry)
+            if pending and isolator is None:
+                logger.warning(f"Batch {operation}: worker crashed, retrying {len(pending)} inputs in isolation")
+                isolator = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+        archive.close()
+        yield stream.drain()
+    finally:
+        # Reached early when the client disconnects; don't leave queued
+        # work running for nobody
+        for future in futures:
+            future.cancel()
+        if isolator is not None:
+            isolator.shutdown(wait=False, cancel_futures=True)
+        for entry in manifest:
+            if entry['status'] == 'pending':
+                entry.update(status='cancelled')
+
+        if on_complete is not None:
+            try:
+                on_complete(manifest, stream.size)
+            except Exception as e:
+                logger.error(f"Batch completion callback failed: {str(e)}")
@@ -1,8 +1,8 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required
-from werkzeug.security import generate_password_hash
 from app import db
 from models import User
+from security import password_hasher, login_throttle, normalize_email, AuthBusy
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -10,16 +10,20 @@ auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
-        email = request.form.get('email')
+        email = normalize_email(request.form.get('email'))
         password = request.form.get('password')
 
-        user = User.query.filter_by(email=email).first()
+        user = User.query.filter(db.func.lower(User.email) == email).first()
         if user:
             flash('Email already registered')
             return redirect(url_for('auth.register'))
 
         new_user = User(username=username, email=email)
-        new_user.set_password(password)
+        try:
+            new_user.set_password(password)
+        except AuthBusy:
+            flash('The server is busy, please try again in a moment')
+            return render_template('auth/register.html'), 503
         
         db.session.add(new_user)
         db.session.commit()
@@ -31,16 +35,35 @@ def register():
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        email = request.form.get('email')
+        email = normalize_email(request.form.get('email'))
         password = request.form.get('password')
         remember = bool(request.form.get('remember'))
+        ip = request.remote_addr
 
-        user = User.query.filter_by(email=email).first()
+        if login_throttle.is_blocked(ip):
+            flash('Too many failed login attempts, please try again later')
+            return render_template('auth/login.html'), 429
 
-        if user and user.check_password(password):
+        user = User.query.filter(db.func.lower(User.email) == email).first()
+
+        try:
+            valid = user.check_password(password) if user else password_hasher.verify(None, password)
+        except AuthBusy:
+            flash('The server is busy, please try again in a moment')
+            return render_template('auth/login.html'), 503
+
+        if valid:
+            # Upgrade hashes made with older parameters while we have the password
+            if password_hasher.needs_rehash(user.password_hash):
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except AuthBusy:
+                    pass
             login_user(user, remember=remember)
             return redirect(url_for('pdf.operations'))
 
+        login_throttle.record_failure(ip)
         flash('Invalid email or password')
         
     return render_template('auth/login.html')
@@ -1,16 +1,24 @@
 import io
+import re
+import base64
 import logging
 import zipfile
 import json
+from datetime import datetime, timedelta
 from PIL import Image
-from flask import Blueprint, render_template, request, jsonify, send_file, Response, current_app
+from flask import Blueprint, render_template, request, jsonify, send_file, Response, current_app, stream_with_context
 from flask_login import login_required, current_user
 from PyPDF2 import PdfMerger, PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.colors import Color, HexColor
-from models import PDFFile
+from models import PDFFile, UsageDaily
+import pdf_ops
+import optimizer
 from app import db
+from storage import storage, StorageQuotaExceeded
+from thumbnails import thumbnails, snap_width
+from batch import BATCH_OPERATIONS, run_batch
 
 pdf_bp = Blueprint('pdf', __name__, url_prefix='/pdf')
 
@@ -22,6 +30,43 @@ def handle_error(error):
     logger.error(f"Operation error: {str(error)}")
     return jsonify({'error': str(error)}), 500
 
+def record_operation(filename, operation_type, input_size, output_data=None, output_size=None,
+                     status='completed', operations=1):
+    """Save the result to storage and log the operation for the current user.
+
+    A result that does not fit the storage quota is still returned to the
+    user, it just isn't kept for later download. Streamed results pass only
+    output_size and are never stored. operations is how many count towards
+    the daily usage, e.g. the files a batch actually processed.
+    """
+    if output_data is not None:
+        output_size = len(output_data)
+    pdf_file = PDFFile(
+        filename=filename,
+        user_id=current_user.id,
+        operation_type=operation_type,
+        status=status,
+        input_size=input_size,
+        output_size=output_size
+    )
+    if output_data is not None:
+        try:
+            storage.store(pdf_file, output_data)
+        except (StorageQuotaExceeded, OSError) as e:
+            logger.warning(f"Result not stored: {str(e)}")
+    db.session.add(pdf_file)
+    UsageDaily.record(current_user.id, operation_type, input_size, output_size, operations=operations)
+    db.session.commit()
+    return pdf_file
+
+def encode_cursor(pdf_file):
+    raw = f"{pdf_file.created_at.isoformat()}|{pdf_file.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    created_at, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(file_id)
+
 @pdf_bp.route('/compress', methods=['POST'])
 @login_required
 def compress_pdf():
@@ -35,52 +80,7 @@ def compress_pdf():
         input_size = len(input_data)
         logger.info(f"Input PDF size: {input_size} bytes")
 
-        pdf = PdfReader(io.BytesIO(input_data))
-        writer = PdfWriter()
-
-        for page_num, page in enumerate(pdf.pages, 1):
-            logger.info(f"Processing page {page_num}")
-
-            # Compress content streams
-            page.compress_content_streams()
-
-            # Remove unnecessary elements
-            unnecessary_keys = ['/Metadata', '/StructParents', '/StructTreeRoot', '/AcroForm']
-            for key in unnecessary_keys:
-                if key in page:
-                    del page[key]
-
-            # Process images
-            if '/Resources' in page:
-                resources = page['/Resources']
-                if '/XObject' in resources:
-                    xObject = resources['/XObject'].get_object()
-
-                    for obj in xObject:
-                        if xObject[obj]['/Subtype'] == '/Image':
-                            image = xObject[obj]
-                            # Convert RGB to Grayscale
-                            if '/ColorSpace' in image and image['/ColorSpace'] == '/DeviceRGB':
-                                image['/ColorSpace'] = '/DeviceGray'
-
-                            # Reduce bits per component
-                            if '/BitsPerComponent' in image:
-                                image['/BitsPerComponent'] = 4
-
-                            # Apply maximum compression to images
-                            if '/Filter' in image:
-                                if isinstance(image['/Filter'], list):
-                                    image['/Filter'] = ['/FlateDecode']
-                                else:
-                                    image['/Filter'] = '/FlateDecode'
-
-            writer.add_page(page)
-
-        # Set maximum compression
-        output = io.BytesIO()
-        writer._compress = True
-        writer.write(output)
-        output.seek(0)
+        output = io.BytesIO(pdf_ops.compress(input_data))
 
         # Compare sizes
         output_size = output.getbuffer().nbytes
@@ -89,14 +89,7 @@ def compress_pdf():
         logger.info(f"Compression ratio: {compression_ratio:.2f}%")
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='compressed.pdf',
-            user_id=current_user.id,
-            operation_type='compress',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('compressed.pdf', 'compress', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -109,11 +102,181 @@ def compress_pdf():
         logger.error(f"Compression error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@pdf_bp.route('/optimize', methods=['POST'])
+@login_required
+def optimize_pdf():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    file = request.files['file']
+    try:
+        input_data = file.read()
+        output_data, stats = optimizer.optimize(input_data)
+        logger.info(f"Optimizer: {stats}")
+
+        # Save operation record
+        record_operation('optimized.pdf', 'optimize', len(input_data), output_data)
+
+        response = send_file(
+            io.BytesIO(output_data),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name='optimized.pdf'
+        )
+        for key, value in stats.items():
+            response.headers[f"X-Optimize-{key.replace('_', '-').title()}"] = str(value)
+        return response
+
+    except Exception as e:
+        logger.error(f"Optimization error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @pdf_bp.route('/operations')
 @login_required
 def operations():
     return render_template('pdf/operations.html')
 
+@pdf_bp.route('/files/<int:file_id>')
+@login_required
+def download_file(file_id):
+    pdf_file = PDFFile.query.filter_by(id=file_id, user_id=current_user.id).first()
+    if not pdf_file:
+        return jsonify({'error': 'File not found'}), 404
+
+    path = storage.touch(pdf_file)
+    if not path:
+        return jsonify({'error': 'File has expired'}), 410
+
+    return send_file(path, as_attachment=True, download_name=pdf_file.filename)
+
+@pdf_bp.route('/preview', methods=['POST'])
+@login_required
+def preview_document():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    width = snap_width(request.form.get('width', current_app.config['THUMBNAIL_WIDTH'], type=int))
+    visible = request.form.get('visible', 6, type=int)
+
+    try:
+        doc_hash, page_count = thumbnails.add_document(current_user.id, request.files['file'].read())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except StorageQuotaExceeded as e:
+        return jsonify({'error': str(e)}), 413
+
+    # The client asks for the pages on screen itself; warm the rest meanwhile
+    thumbnails.prefetch(current_user.id, doc_hash, range(max(visible, 0), page_count), width)
+
+    return jsonify({'doc': doc_hash, 'pages': page_count, 'width': width})
+
+@pdf_bp.route('/preview/<doc_hash>/<int:page>.png')
+@login_required
+def preview_page(doc_hash, page):
+    if not re.fullmatch(r'[0-9a-f]{64}', doc_hash) or page < 1:
+        return jsonify({'error': 'Preview not found'}), 404
+
+    width = snap_width(request.args.get('w', current_app.config['THUMBNAIL_WIDTH'], type=int))
+    etag = f'{doc_hash[:16]}-{page}-{width}'
+
+    # Content is addressed by hash, so a matching ETag never needs a render
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        if not thumbnails.has_document(current_user.id, doc_hash):
+            return jsonify({'error': 'Preview not found'}), 404
+        try:
+            png = thumbnails.get(current_user.id, doc_hash, page - 1, width)
+        except IndexError:
+            return jsonify({'error': 'Page out of range'}), 404
+        response = Response(png, mimetype='image/png')
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
+
+@pdf_bp.route('/history')
+@login_required
+def history():
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    cursor = request.args.get('cursor')
+
+    query = PDFFile.query.filter(PDFFile.user_id == current_user.id)
+    if cursor:
+        try:
+            created_at, file_id = decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        # Keyset pagination: continue strictly after the last row already seen
+        query = query.filter(db.or_(
+            PDFFile.created_at < created_at,
+            db.and_(PDFFile.created_at == created_at, PDFFile.id < file_id)
+        ))
+
+    rows = query.order_by(PDFFile.created_at.desc(), PDFFile.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        'items': [{
+            'id': row.id,
+            'filename': row.filename,
+            'operation_type': row.operation_type,
+            'status': row.status,
+            'created_at': row.created_at.isoformat(),
+            'input_size': row.input_size,
+            'output_size': row.output_size,
+            'available': row.storage_path is not None
+        } for row in rows],
+        'next_cursor': encode_cursor(rows[-1]) if has_more else None
+    })
+
+@pdf_bp.route('/usage')
+@login_required
+def usage():
+    days = min(max(request.args.get('days', 30, type=int), 1), 365)
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+
+    rows = UsageDaily.query.filter(
+        UsageDaily.user_id == current_user.id,
+        UsageDaily.day >= since
+    ).order_by(UsageDaily.day.asc(), UsageDaily.operation_type.asc()).all()
+
+    return jsonify({
+        'since': since.isoformat(),
+        'today': UsageDaily.operations_on(current_user.id),
+        'daily': [{
+            'day': row.day.isoformat(),
+            'operation_type': row.operation_type,
+            'operations': row.operations,
+            'input_bytes': row.input_bytes,
+            'output_bytes': row.output_bytes
+        } for row in rows]
+    })
+
+@pdf_bp.route('/dashboard')
+@login_required
+def dashboard():
+    recent = PDFFile.query.filter_by(user_id=current_user.id).order_by(
+        PDFFile.created_at.desc(), PDFFile.id.desc()
+    ).limit(5).all()
+    daily_limit = 3 if current_user.subscription_status == 'free' else 999
+    return render_template('dashboard.html',
+                           recent_operations=recent,
+                           daily_ops=UsageDaily.operations_on(current_user.id),
+                           daily_limit=daily_limit)
+
+@pdf_bp.route('/storage')
+@login_required
+def storage_usage():
+    return jsonify({
+        'used': storage.usage(current_user.id),
+        'quota': current_app.config['STORAGE_USER_QUOTA'],
+        'ttl': current_app.config['STORAGE_TTL']
+    })
+
 @pdf_bp.route('/merge', methods=['POST'])
 @login_required
 def merge_pdfs():
@@ -124,23 +287,18 @@ def merge_pdfs():
     merger = PdfMerger()
 
     try:
+        input_size = 0
         for file in files:
-            pdf_content = io.BytesIO(file.read())
-            merger.append(pdf_content)
+            pdf_content = file.read()
+            input_size += len(pdf_content)
+            merger.append(io.BytesIO(pdf_content))
 
         output = io.BytesIO()
         merger.write(output)
         output.seek(0)
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='merged.pdf',
-            user_id=current_user.id,
-            operation_type='merge',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('merged.pdf', 'merge', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -152,6 +310,54 @@ def merge_pdfs():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@pdf_bp.route('/batch', methods=['POST'])
+@login_required
+def batch_process():
+    operation = request.form.get('operation')
+    if operation not in BATCH_OPERATIONS:
+        return jsonify({'error': 'Unsupported batch operation'}), 400
+
+    files = request.files.getlist('files[]')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+
+    if operation == 'watermark':
+        options = {'text': request.form.get('text', 'Watermark')}
+    elif operation == 'rotate':
+        options = {'angle': int(request.form.get('angle', 90)), 'pages': request.form.get('pages', '')}
+    elif operation == 'split':
+        if not request.form.get('ranges'):
+            return jsonify({'error': 'Page ranges are required'}), 400
+        options = {'ranges': request.form['ranges']}
+    else:
+        options = {}
+
+    inputs = [(file.filename, file.read()) for file in files]
+    input_size = sum(len(data) for _, data in inputs)
+
+    def finish(manifest, archive_size):
+        completed = sum(1 for entry in manifest if entry['status'] == 'completed')
+        cancelled = sum(1 for entry in manifest if entry['status'] == 'cancelled')
+        if completed == len(manifest):
+            status = 'completed'
+        elif completed:
+            status = 'partial'
+        elif cancelled:
+            status = 'cancelled'
+        else:
+            status = 'failed'
+        logger.info(f"Batch {operation}: {completed} completed, {len(manifest) - completed} failed or cancelled")
+        # Each processed file counts towards the daily limit like a single operation
+        record_operation(f'batch_{operation}.zip', operation, input_size, output_size=archive_size,
+                         status=status, operations=completed)
+
+    response = Response(
+        stream_with_context(run_batch(operation, inputs, options, on_complete=finish)),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename=batch_{operation}.zip'
+    return response
+
 @pdf_bp.route('/split', methods=['POST'])
 @login_required
 def split_pdf():
@@ -160,18 +366,12 @@ def split_pdf():
 
     file = request.files['file']
     try:
-        pdf = PdfReader(io.BytesIO(file.read()))
-        writer = PdfWriter()
-
-        page_ranges = request.form.get('ranges', '').split(',')
-        for range_str in page_ranges:
-            start, end = map(int, range_str.split('-'))
-            for page_num in range(start - 1, min(end, len(pdf.pages))):
-                writer.add_page(pdf.pages[page_num])
+        input_data = file.read()
+        input_size = len(input_data)
+        output = io.BytesIO(pdf_ops.split(input_data, request.form.get('ranges', '')))
 
-        output = io.BytesIO()
-        writer.write(output)
-        output.seek(0)
+        # Save operation record
+        record_operation('split.pdf', 'split', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -193,39 +393,13 @@ def watermark_pdf():
     watermark_text = request.form.get('text', 'Watermark')
 
     try:
-        # Create watermark
-        watermark_buffer = io.BytesIO()
-        c = canvas.Canvas(watermark_buffer, pagesize=letter)
-        c.setFont("Helvetica", 60)
-        c.setFillAlpha(0.3)  # Set transparency
-        c.translate(300, 400)
-        c.rotate(45)
-        c.drawString(0, 0, watermark_text)
-        c.save()
-        watermark_buffer.seek(0)
-
         # Apply watermark to PDF
-        pdf = PdfReader(io.BytesIO(file.read()))
-        watermark_pdf = PdfReader(watermark_buffer)
-        writer = PdfWriter()
-
-        for page in pdf.pages:
-            page.merge_page(watermark_pdf.pages[0])
-            writer.add_page(page)
-
-        output = io.BytesIO()
-        writer.write(output)
-        output.seek(0)
+        input_data = file.read()
+        input_size = len(input_data)
+        output = io.BytesIO(pdf_ops.watermark(input_data, watermark_text))
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='watermarked.pdf',
-            user_id=current_user.id,
-            operation_type='watermark',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('watermarked.pdf', 'watermark', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -250,7 +424,9 @@ def encrypt_pdf():
         return jsonify({'error': 'Password is required'}), 400
 
     try:
-        pdf = PdfReader(io.BytesIO(file.read()))
+        input_data = file.read()
+        input_size = len(input_data)
+        pdf = PdfReader(io.BytesIO(input_data))
         writer = PdfWriter()
 
         for page in pdf.pages:
@@ -262,14 +438,7 @@ def encrypt_pdf():
         output.seek(0)
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='encrypted.pdf',
-            user_id=current_user.id,
-            operation_type='encrypt',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('encrypted.pdf', 'encrypt', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -292,7 +461,9 @@ def pdf_to_images():
     dpi = int(request.form.get('dpi', 300))
 
     try:
-        pdf = PdfReader(io.BytesIO(file.read()))
+        input_data = file.read()
+        input_size = len(input_data)
+        pdf = PdfReader(io.BytesIO(input_data))
         zip_buffer = io.BytesIO()
 
         with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
@@ -315,14 +486,7 @@ def pdf_to_images():
         zip_buffer.seek(0)
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='pdf_images.zip',
-            user_id=current_user.id,
-            operation_type='to_images',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('pdf_images.zip', 'to_images', input_size, zip_buffer.getvalue())
 
         return send_file(
             zip_buffer,
@@ -346,41 +510,12 @@ def rotate_pages():
     pages = request.form.get('pages', '')
 
     try:
-        pdf = PdfReader(io.BytesIO(file.read()))
-        writer = PdfWriter()
-
-        # Parse page ranges
-        if pages:
-            page_list = []
-            for range_str in pages.split(','):
-                if '-' in range_str:
-                    start, end = map(int, range_str.split('-'))
-                    page_list.extend(range(start - 1, min(end, len(pdf.pages))))
-                else:
-                    page_list.append(int(range_str) - 1)
-        else:
-            page_list = range(len(pdf.pages))
-
-        # Rotate specified pages
-        for i in range(len(pdf.pages)):
-            page = pdf.pages[i]
-            if i in page_list:
-                page.rotate(angle)
-            writer.add_page(page)
-
-        output = io.BytesIO()
-        writer.write(output)
-        output.seek(0)
+        input_data = file.read()
+        input_size = len(input_data)
+        output = io.BytesIO(pdf_ops.rotate(input_data, angle, pages))
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='rotated.pdf',
-            user_id=current_user.id,
-            operation_type='rotate',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('rotated.pdf', 'rotate', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -419,7 +554,9 @@ def add_text():
         text_layer.seek(0)
 
         # Merge text layer with original PDF
-        pdf = PdfReader(io.BytesIO(file.read()))
+        input_data = file.read()
+        input_size = len(input_data)
+        pdf = PdfReader(io.BytesIO(input_data))
         text_pdf = PdfReader(text_layer)
         writer = PdfWriter()
 
@@ -432,14 +569,7 @@ def add_text():
         output.seek(0)
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='text_added.pdf',
-            user_id=current_user.id,
-            operation_type='add_text',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('text_added.pdf', 'add_text', input_size, output.getvalue())
 
         return send_file(
             output,
@@ -463,7 +593,9 @@ def extract_text():
         pages = request.form.get('pages', '')
         format = request.form.get('format', 'txt')
 
-        pdf = PdfReader(io.BytesIO(file.read()))
+        input_data = file.read()
+        input_size = len(input_data)
+        pdf = PdfReader(io.BytesIO(input_data))
 
         # Parse page ranges
         if pages:
@@ -483,21 +615,18 @@ def extract_text():
             if i < len(pdf.pages):
                 text_content[f'page_{i+1}'] = pdf.pages[i].extract_text()
 
-        # Save operation record
-        pdf_file = PDFFile(
-            filename=f'extracted_text.{format}',
-            user_id=current_user.id,
-            operation_type='extract_text',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
-
         if format == 'json':
+            # Save operation record
+            record_operation('extracted_text.json', 'extract_text', input_size,
+                             json.dumps(text_content).encode('utf-8'))
             return jsonify(text_content)
         else:
             # Format as plain text
             text = '\n\n'.join([f'=== Page {k} ===\n{v}' for k, v in text_content.items()])
+
+            # Save operation record
+            record_operation('extracted_text.txt', 'extract_text', input_size, text.encode('utf-8'))
+
             response = Response(text, mimetype='text/plain')
             response.headers['Content-Disposition'] = f'attachment; filename=extracted_text.txt'
             return response
@@ -516,7 +645,9 @@ def organize_pages():
     layout = request.form.get('layout', '1x1')
 
     try:
-        pdf = PdfReader(io.BytesIO(file.read()))
+        input_data = file.read()
+        input_size = len(input_data)
+        pdf = PdfReader(io.BytesIO(input_data))
         writer = PdfWriter()
 
         # Parse layout
@@ -552,14 +683,7 @@ def organize_pages():
         output.seek(0)
 
         # Save operation record
-        pdf_file = PDFFile(
-            filename='organized.pdf',
-            user_id=current_user.id,
-            operation_type='organize',
-            status='completed'
-        )
-        db.session.add(pdf_file)
-        db.session.commit()
+        record_operation('organized.pdf', 'organize', input_size, output.getvalue())
 
         return send_file(
             output,
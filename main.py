@@ -1,6 +1,13 @@
+import os
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if os.environ.get('SERVER_MODE') == 'asgi':
+        # Non-blocking uploads/downloads; view code runs on a thread pool
+        import uvicorn
+        from asgi import create_asgi_app
+        uvicorn.run(create_asgi_app(app), host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=True)
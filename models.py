@@ -1,7 +1,8 @@
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from security import password_hasher
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -13,15 +14,91 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+# Logins look users up by lower(email)
+db.Index('ix_user_email_lower', db.func.lower(User.email))
 
 class PDFFile(db.Model):
+    __table_args__ = (
+        db.Index('ix_pdf_file_user_created', 'user_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     operation_type = db.Column(db.String(50))
     status = db.Column(db.String(20), default='processing')
+    input_size = db.Column(db.BigInteger, default=0)
+    output_size = db.Column(db.BigInteger, default=0)
+    storage_path = db.Column(db.String(512))
+    last_accessed = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Quota checks sum output_size over stored files and eviction walks them by
+# last_accessed. Indexing only stored rows keeps both off the full history.
+_stored = PDFFile.storage_path.isnot(None)
+db.Index('ix_pdf_file_stored_user', PDFFile.user_id, PDFFile.last_accessed, PDFFile.output_size,
+         sqlite_where=_stored, postgresql_where=_stored)
+db.Index('ix_pdf_file_stored_accessed', PDFFile.last_accessed, PDFFile.output_size,
+         sqlite_where=_stored, postgresql_where=_stored)
+
+class UsageDaily(db.Model):
+    """Per-user, per-day, per-operation counters kept alongside PDFFile.
+
+    Rows are bumped as operations are recorded so that usage reads touch a
+    handful of rows no matter how long the operation history grows.
+    """
+    __tablename__ = 'usage_daily'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'operation_type', name='uq_usage_daily'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    operation_type = db.Column(db.String(50), nullable=False)
+    operations = db.Column(db.Integer, default=0, nullable=False)
+    input_bytes = db.Column(db.BigInteger, default=0, nullable=False)
+    output_bytes = db.Column(db.BigInteger, default=0, nullable=False)
+
+    @classmethod
+    def record(cls, user_id, operation_type, input_size=0, output_size=0, day=None, operations=1):
+        """Add operations to the rollup, one unless a batch says otherwise.
+        The caller commits."""
+        day = day or datetime.utcnow().date()
+        key = (cls.user_id == user_id, cls.day == day, cls.operation_type == operation_type)
+        values = {
+            'operations': cls.operations + operations,
+            'input_bytes': cls.input_bytes + (input_size or 0),
+            'output_bytes': cls.output_bytes + (output_size or 0),
+        }
+
+        updated = cls.query.filter(*key).update(values, synchronize_session=False)
+        if updated:
+            return
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(
+                    user_id=user_id,
+                    day=day,
+                    operation_type=operation_type,
+                    operations=operations,
+                    input_bytes=input_size or 0,
+                    output_bytes=output_size or 0
+                ))
+        except IntegrityError:
+            # Another request created the row first
+            cls.query.filter(*key).update(values, synchronize_session=False)
+
+    @classmethod
+    def operations_on(cls, user_id, day=None):
+        day = day or datetime.utcnow().date()
+        total = db.session.query(db.func.coalesce(db.func.sum(cls.operations), 0)).filter(
+            cls.user_id == user_id, cls.day == day
+        ).scalar()
+        return int(total)
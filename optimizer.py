@@ -0,0 +1,477 @@
+import io
+import zlib
+import hashlib
+import logging
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    ContentStream,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    StreamObject,
+)
+
+logger = logging.getLogger(__name__)
+
+# Resource categories whose entries are only reachable by name from the
+# page's content stream, and the operators that use them.
+PRUNABLE_RESOURCES = ('/XObject', '/Font', '/ExtGState', '/Shading', '/Pattern', '/Properties')
+RESOURCE_OPERATORS = {b'Do': '/XObject', b'Tf': '/Font', b'gs': '/ExtGState', b'sh': '/Shading'}
+
+# Graphics-state operators that just set a value, so repeating one with the
+# same operands is a no-op.
+STATE_OPERATORS = {b'w', b'J', b'j', b'M', b'd', b'ri', b'i', b'gs'}
+
+# Never merge these even if they serialize identically: each one may only
+# appear in one place in the document.
+UNIQUE_TYPES = {'/Catalog', '/Pages', '/Page', '/Annot', '/OCG', '/OCMD', '/StructTreeRoot', '/StructElem'}
+
+OBJECTS_PER_STREAM = 100
+MAX_DEDUPE_PASSES = 10
+
+
+def optimize(data, object_streams=True):
+    """Rewrite a PDF keeping only what its pages actually need.
+
+    Returns (pdf bytes, stats). The passes are: prune unused page resources
+    and redundant graphics-state operators, sweep out objects unreachable
+    from the trailer, deflate unfiltered streams, merge objects that
+    serialize identically, and write the result with compressed object
+    streams and a cross-reference stream. The original bytes are returned
+    unchanged when the document is encrypted or nothing was gained.
+    """
+    reader = PdfReader(io.BytesIO(data))
+    stats = {
+        'input_size': len(data),
+        'output_size': len(data),
+        'objects_before': None,
+        'objects_after': None,
+        'orphans_removed': 0,
+        'duplicates_merged': 0,
+        'resources_pruned': 0,
+        'operators_removed': 0,
+    }
+    if reader.is_encrypted:
+        logger.info("Skipping optimization of encrypted PDF")
+        return data, stats
+
+    optimizer = DocumentOptimizer(reader)
+    output = optimizer.run(object_streams)
+    stats.update(optimizer.stats)
+
+    if len(output) >= len(data):
+        logger.info("Optimization did not reduce size, keeping original")
+        return data, stats
+
+    stats['output_size'] = len(output)
+    return output, stats
+
+
+class DocumentOptimizer:
+    def __init__(self, reader):
+        self.reader = reader
+        self.stats = {}
+        self.objects = {}   # key -> object, in discovery order
+        self.hoisted = {}   # id(direct stream) -> key
+        self.canonical = {}  # key -> key of the object it was merged into
+        self.numbers = {}   # canonical key -> object number
+
+    def run(self, object_streams=True):
+        trailer = self.reader.trailer
+        roots = [trailer.raw_get('/Root')]
+        if '/Info' in trailer:
+            roots.append(trailer.raw_get('/Info'))
+
+        # Resources reachable from anything other than a page (forms,
+        # annotation appearances, Type3 fonts) are never pruned
+        keep_all = set()
+        self._sweep(roots, keep_all)
+        existing = self._existing_keys()
+        self.stats['objects_before'] = len(existing)
+        self.stats['orphans_removed'] = len(existing - set(self.objects))
+        self.stats['resources_pruned'], self.stats['operators_removed'] = self._prune_pages(keep_all)
+
+        self.objects = {}
+        self.hoisted = {}
+        self._sweep(roots)
+
+        self._deflate_streams()
+        self.stats['duplicates_merged'] = self._dedupe()
+
+        order = [key for key in self.objects if self.canonical[key] == key]
+        self.numbers = {key: number for number, key in enumerate(order, 1)}
+        self.stats['objects_after'] = len(order)
+
+        return self._write(order, roots, object_streams)
+
+    # Graph walking
+
+    @staticmethod
+    def _ref_key(ref):
+        return ('ref', ref.idnum, ref.generation)
+
+    def _existing_keys(self):
+        """Keys of the objects in the input, leaving out free entries and
+        the object streams and xref streams that only package the others."""
+        keys = set()
+        for generation, entries in self.reader.xref.items():
+            free = self.reader.xref_free_entry.get(generation, {})
+            for idnum in entries:
+                if idnum == 0 or free.get(idnum):
+                    continue
+                try:
+                    obj = self.reader.get_object(IndirectObject(idnum, generation, self.reader))
+                except Exception:
+                    continue
+                if isinstance(obj, StreamObject) and obj.get('/Type') in ('/ObjStm', '/XRef'):
+                    continue
+                keys.add(('ref', idnum, generation))
+        keys.update(('ref', idnum, 0) for idnum in self.reader.xref_objStm)
+        return keys
+
+    def _sweep(self, roots, keep_all=None):
+        """Collect every object reachable from roots into self.objects.
+
+        Stream objects found inline are hoisted to objects of their own,
+        since streams must be indirect.
+        """
+        stack = [(root, False) for root in reversed(roots)]
+        while stack:
+            item, top = stack.pop()
+
+            if isinstance(item, IndirectObject):
+                key = self._ref_key(item)
+                if key in self.objects:
+                    continue
+                obj = item.get_object()
+                self.objects[key] = obj
+                stack.append((obj, True))
+                continue
+
+            if isinstance(item, StreamObject) and not top:
+                if id(item) in self.hoisted:
+                    continue
+                key = ('obj', id(item))
+                self.hoisted[id(item)] = key
+                self.objects[key] = item
+
+            if isinstance(item, DictionaryObject):
+                if keep_all is not None and '/Resources' in item and item.get('/Type') != '/Page':
+                    resources = item['/Resources'].get_object()
+                    if isinstance(resources, DictionaryObject):
+                        for category in PRUNABLE_RESOURCES:
+                            if category in resources:
+                                keep_all.add(id(resources[category].get_object()))
+                values = [value for name, value in item.items()
+                          if not (isinstance(item, StreamObject) and name == '/Length')]
+                stack.extend((value, False) for value in reversed(values))
+            elif isinstance(item, ArrayObject):
+                stack.extend((value, False) for value in reversed(item))
+
+    # Page-level passes
+
+    def _prune_pages(self, keep_all):
+        used = {}      # id(resource subdict) -> names referenced by content
+        subdicts = {}  # id(resource subdict) -> subdict
+        removed_operators = 0
+
+        for page in self.reader.pages:
+            resources = page.get('/Resources')
+            resources = resources.get_object() if resources is not None else None
+            if not isinstance(resources, DictionaryObject):
+                continue
+
+            try:
+                contents = page.get_contents()
+                content = ContentStream(contents, self.reader) if contents is not None else None
+                names = used_resource_names(content.operations) if content is not None else {}
+            except Exception as e:
+                logger.warning(f"Could not parse page content, keeping its resources: {str(e)}")
+                content, names = None, None
+
+            for category in PRUNABLE_RESOURCES:
+                if category not in resources:
+                    continue
+                subdict = resources[category].get_object()
+                if not isinstance(subdict, DictionaryObject):
+                    continue
+                subdicts[id(subdict)] = subdict
+                if names is None:
+                    keep_all.add(id(subdict))
+                else:
+                    used.setdefault(id(subdict), set()).update(names.get(category, ()))
+
+            if content is not None:
+                operations, removed = strip_redundant_operators(content.operations)
+                if removed:
+                    content.operations = operations
+                    # reader.pages hands out copies; write to the page
+                    # object that actually gets serialized
+                    target = page.indirect_reference.get_object() if page.indirect_reference else page
+                    target[NameObject('/Contents')] = content.flate_encode()
+                    removed_operators += removed
+
+        pruned = 0
+        for ident, subdict in subdicts.items():
+            if ident in keep_all:
+                continue
+            for name in [name for name in subdict if name not in used.get(ident, ())]:
+                del subdict[name]
+                pruned += 1
+        return pruned, removed_operators
+
+    # Object-level passes
+
+    def _deflate_streams(self):
+        for key, obj in self.objects.items():
+            if not isinstance(obj, StreamObject) or '/Filter' in obj or '/DecodeParms' in obj:
+                continue
+            raw = stream_bytes(obj)
+            packed = zlib.compress(raw, 9)
+            if len(packed) >= len(raw):
+                continue
+            encoded = EncodedStreamObject()
+            for name, value in obj.items():
+                if name != '/Length':
+                    encoded[name] = value
+            encoded[NameObject('/Filter')] = NameObject('/FlateDecode')
+            encoded._data = packed
+            self.objects[key] = encoded
+            if key[0] == 'obj':
+                self.hoisted[id(encoded)] = key
+
+    def _dedupe(self):
+        """Merge objects that serialize identically, children first, so that
+        parents which only differed by which duplicate they pointed to merge
+        on the next pass."""
+        self.canonical = {key: key for key in self.objects}
+        merged = 0
+        for _ in range(MAX_DEDUPE_PASSES):
+            seen = {}
+            changed = 0
+            for key, obj in self.objects.items():
+                if self.canonical[key] != key:
+                    continue
+                if isinstance(obj, DictionaryObject) and has_identity(obj):
+                    continue
+                digest = hashlib.sha256(self._serialize(obj, self._canonical_ref)).digest()
+                if digest in seen:
+                    self.canonical[key] = seen[digest]
+                    changed += 1
+                else:
+                    seen[digest] = key
+            if not changed:
+                break
+            merged += changed
+            # Point merged objects straight at their final target
+            for key in self.canonical:
+                target = self.canonical[key]
+                while self.canonical[target] != target:
+                    target = self.canonical[target]
+                self.canonical[key] = target
+        return merged
+
+    # Serialization
+
+    def _canonical_ref(self, key):
+        return repr(self.canonical.get(key, key)).encode()
+
+    def _number(self, key):
+        return self.numbers.get(self.canonical.get(key, key))
+
+    def _number_ref(self, key):
+        number = self._number(key)
+        return ref_bytes(number) if number is not None else None
+
+    def _serialize(self, obj, resolve):
+        out = io.BytesIO()
+        self._write_object(obj, out, resolve, top=True)
+        return out.getvalue()
+
+    def _write_object(self, obj, out, resolve, top=False):
+        if isinstance(obj, IndirectObject):
+            out.write(resolve(self._ref_key(obj)) or b'null')
+        elif isinstance(obj, StreamObject) and not top:
+            out.write(resolve(self.hoisted[id(obj)]))
+        elif isinstance(obj, DictionaryObject):
+            out.write(b'<<')
+            for name, value in obj.items():
+                if isinstance(obj, StreamObject) and name == '/Length':
+                    continue
+                NameObject(name).write_to_stream(out, None)
+                out.write(b' ')
+                self._write_object(value, out, resolve)
+            if isinstance(obj, StreamObject):
+                data = stream_bytes(obj)
+                out.write(b'/Length %d>>\nstream\n' % len(data))
+                out.write(data)
+                out.write(b'\nendstream')
+            else:
+                out.write(b'>>')
+        elif isinstance(obj, ArrayObject):
+            out.write(b'[')
+            for index, value in enumerate(obj):
+                if index:
+                    out.write(b' ')
+                self._write_object(value, out, resolve)
+            out.write(b']')
+        elif obj is None:
+            out.write(b'null')
+        else:
+            obj.write_to_stream(out, None)
+
+    def _write(self, order, roots, object_streams):
+        out = io.BytesIO()
+        version = max(self.reader.pdf_header[5:8] if self.reader.pdf_header else '1.5', '1.5')
+        out.write(f'%PDF-{version}\n'.encode())
+        out.write(b'%\xe2\xe3\xcf\xd3\n')
+
+        entries = {}  # object number -> (type, field2, field3)
+        packable = []
+        for key in order:
+            number = self.numbers[key]
+            obj = self.objects[key]
+            if object_streams and not isinstance(obj, StreamObject):
+                packable.append(number)
+                continue
+            entries[number] = (1, out.tell(), 0)
+            out.write(b'%d 0 obj\n' % number)
+            out.write(self._serialize(obj, self._number_ref))
+            out.write(b'\nendobj\n')
+
+        next_number = len(order) + 1
+        bodies = {self.numbers[key]: self._serialize(self.objects[key], self._number_ref) for key in order}
+        for start in range(0, len(packable), OBJECTS_PER_STREAM):
+            chunk = packable[start:start + OBJECTS_PER_STREAM]
+            container = next_number
+            next_number += 1
+
+            header, body = [], io.BytesIO()
+            for index, number in enumerate(chunk):
+                header.append(b'%d %d' % (number, body.tell()))
+                body.write(bodies[number])
+                body.write(b'\n')
+                entries[number] = (2, container, index)
+            header = b' '.join(header) + b'\n'
+            packed = zlib.compress(header + body.getvalue(), 9)
+
+            entries[container] = (1, out.tell(), 0)
+            out.write(b'%d 0 obj\n' % container)
+            out.write(b'<</Type/ObjStm/N %d/First %d/Filter/FlateDecode/Length %d>>\nstream\n'
+                      % (len(chunk), len(header), len(packed)))
+            out.write(packed)
+            out.write(b'\nendstream\nendobj\n')
+
+        # The cross-reference stream lists itself as the last object
+        xref_number = next_number
+        xref_offset = out.tell()
+        entries[xref_number] = (1, xref_offset, 0)
+        size = xref_number + 1
+
+        rows = [bytes([0]) + (0).to_bytes(4, 'big') + (65535).to_bytes(2, 'big')]
+        for number in range(1, size):
+            kind, field2, field3 = entries.get(number, (0, 0, 0))
+            rows.append(bytes([kind]) + field2.to_bytes(4, 'big') + field3.to_bytes(2, 'big'))
+        packed = zlib.compress(b''.join(rows), 9)
+
+        trailer = io.BytesIO()
+        trailer.write(b'<</Type/XRef/Size %d/W[1 4 2]/Root ' % size)
+        trailer.write(self._number_ref(self._ref_key(roots[0])))
+        if len(roots) > 1:
+            info = roots[1]
+            # /Info is normally a reference, but some writers inline it
+            if not isinstance(info, IndirectObject):
+                trailer.write(b'/Info')
+                trailer.write(self._serialize(info, self._number_ref))
+            elif self._number(self._ref_key(info)) is not None:
+                trailer.write(b'/Info ')
+                trailer.write(self._number_ref(self._ref_key(info)))
+        if '/ID' in self.reader.trailer:
+            trailer.write(b'/ID')
+            self.reader.trailer['/ID'].get_object().write_to_stream(trailer, None)
+        trailer.write(b'/Filter/FlateDecode/Length %d>>' % len(packed))
+
+        out.write(b'%d 0 obj\n' % xref_number)
+        out.write(trailer.getvalue())
+        out.write(b'\nstream\n')
+        out.write(packed)
+        out.write(b'\nendstream\nendobj\n')
+        out.write(b'startxref\n%d\n%%%%EOF\n' % xref_offset)
+        return out.getvalue()
+
+
+def ref_bytes(number):
+    return b'%d 0 R' % number
+
+
+def stream_bytes(obj):
+    data = obj._data
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    return data
+
+
+def has_identity(obj):
+    """Whether a dictionary must stay distinct even from an identical twin.
+
+    Annotations, form fields and structure elements often leave out /Type,
+    so they are also recognised by their required keys.
+    """
+    if obj.get('/Type') in UNIQUE_TYPES:
+        return True
+    if '/Subtype' in obj and '/Rect' in obj:  # annotation
+        return True
+    if '/FT' in obj or ('/T' in obj and ('/Kids' in obj or '/Parent' in obj)):  # form field
+        return True
+    return '/S' in obj and '/P' in obj  # structure element
+
+
+def used_resource_names(operations):
+    """Map resource category -> names referenced by a page's content."""
+    names = {}
+    for operands, operator in operations:
+        if operator in RESOURCE_OPERATORS and operands and isinstance(operands[0], NameObject):
+            names.setdefault(RESOURCE_OPERATORS[operator], set()).add(operands[0])
+        elif operator in (b'scn', b'SCN') and operands and isinstance(operands[-1], NameObject):
+            names.setdefault('/Pattern', set()).add(operands[-1])
+        elif operator in (b'BDC', b'DP') and len(operands) > 1 and isinstance(operands[1], NameObject):
+            names.setdefault('/Properties', set()).add(operands[1])
+    return names
+
+
+def strip_redundant_operators(operations):
+    """Drop empty q/Q pairs and state operators that repeat the current value.
+
+    Returns (operations, number removed). Tracked values follow the q/Q
+    stack. An ExtGState can change any of them, so gs resets tracking, and
+    any other state operator forgets the last gs so it is never dropped as
+    a repeat.
+    """
+    result = []
+    state = [{}]
+    removed = 0
+    for operands, operator in operations:
+        if operator == b'q':
+            state.append(dict(state[-1]))
+        elif operator == b'Q':
+            if len(state) > 1:
+                state.pop()
+            if result and result[-1][1] == b'q':
+                result.pop()
+                removed += 2
+                continue
+        elif operator in STATE_OPERATORS:
+            value = tuple(repr(operand) for operand in operands)
+            if state[-1].get(operator) == value:
+                removed += 1
+                continue
+            if operator == b'gs':
+                state[-1].clear()
+            else:
+                state[-1].pop(b'gs', None)
+            state[-1][operator] = value
+        result.append((operands, operator))
+    return result, removed
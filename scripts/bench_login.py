@@ -0,0 +1,120 @@
+"""Benchmark: login burst alongside PDF traffic.
+
+Registers --users accounts, then fires --burst concurrent logins while a
+second set of clients keeps calling a cheap PDF endpoint. Reports login
+and PDF latency percentiles plus how many logins were shed with 503. With
+password hashing on its bounded pool, PDF latency should barely move
+during the burst and login p99 should stay bounded by the queue size.
+
+    python main.py    # or SERVER_MODE=asgi python main.py
+    python scripts/bench_login.py --url http://127.0.0.1:5000 --burst 200
+"""
+import time
+import uuid
+import argparse
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlencode
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def post(host, port, path, form):
+    conn = http.client.HTTPConnection(host, port, timeout=120)
+    start = time.perf_counter()
+    conn.request('POST', path, urlencode(form), FORM_HEADERS)
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response, time.perf_counter() - start
+
+
+def register(host, port, count):
+    users = []
+    for _ in range(count):
+        email = f"bench-{uuid.uuid4().hex[:10]}@example.com"
+        form = {'username': email.split('@')[0], 'email': email, 'password': 'bench-password'}
+        post(host, port, '/auth/register', form)
+        users.append(form)
+    return users
+
+
+def login(host, port, form):
+    response, elapsed = post(host, port, '/auth/login', form)
+    return response.status, elapsed, response.getheader('Set-Cookie')
+
+
+def pdf_probe(host, port, cookie, stop, latencies):
+    while not stop.is_set():
+        conn = http.client.HTTPConnection(host, port, timeout=120)
+        start = time.perf_counter()
+        conn.request('GET', '/pdf/storage', headers={'Cookie': cookie})
+        conn.getresponse().read()
+        conn.close()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.05)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def report(label, values):
+    if not values:
+        print(f"{label}: no samples")
+        return
+    print(f"{label}: n={len(values)} p50={percentile(values, 50) * 1000:.0f}ms "
+          f"p99={percentile(values, 99) * 1000:.0f}ms max={max(values) * 1000:.0f}ms")
+
+
+def main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+
+    print(f"registering {args.users} users...")
+    users = register(host, port, args.users)
+    status, _, cookie = login(host, port, users[0])
+    if status != 302 or not cookie:
+        raise SystemExit('Login failed; is the server running with a database?')
+    cookie = cookie.split(';', 1)[0]
+
+    # Baseline PDF latency with no login traffic
+    baseline, stop = [], threading.Event()
+    probe = threading.Thread(target=pdf_probe, args=(host, port, cookie, stop, baseline))
+    probe.start()
+    time.sleep(2)
+    stop.set()
+    probe.join()
+
+    during, stop = [], threading.Event()
+    probes = [threading.Thread(target=pdf_probe, args=(host, port, cookie, stop, during))
+              for _ in range(args.probes)]
+    for probe in probes:
+        probe.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.burst) as pool:
+        results = list(pool.map(lambda i: login(host, port, users[i % len(users)]), range(args.burst)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for probe in probes:
+        probe.join()
+
+    ok = [r[1] for r in results if r[0] == 302]
+    shed = sum(1 for r in results if r[0] == 503)
+    other = len(results) - len(ok) - shed
+    print(f"burst of {args.burst} logins in {elapsed:.1f}s: {len(ok)} ok, {shed} shed (503), {other} other")
+    report('login', ok)
+    report('pdf baseline', baseline)
+    report('pdf during burst', during)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=20, help='accounts to create')
+    parser.add_argument('--burst', type=int, default=200, help='concurrent login requests')
+    parser.add_argument('--probes', type=int, default=4, help='concurrent PDF clients during the burst')
+    main(parser.parse_args())
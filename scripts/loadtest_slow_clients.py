@@ -0,0 +1,175 @@
+"""Load test: many slow clients against the PDF endpoints.
+
+Opens --clients connections that trickle a watermark upload a few bytes at
+a time and then read the result just as slowly, while a probe keeps timing
+fast requests against the same server. With the ASGI serving mode the probe
+latency should stay flat however many slow clients are connected.
+
+    SERVER_MODE=asgi python main.py
+    python scripts/loadtest_slow_clients.py --url http://127.0.0.1:5000 --clients 1000
+"""
+import io
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+import http.client
+from urllib.parse import urlsplit, urlencode
+from reportlab.pdfgen import canvas
+
+
+def make_pdf(pages=3):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer)
+    for page in range(pages):
+        c.drawString(100, 700, f"Load test page {page + 1}")
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def login(host, port):
+    """Register a throwaway user and return its session cookie."""
+    email = f"load-{uuid.uuid4().hex[:8]}@example.com"
+    form = {'username': email.split('@')[0], 'email': email, 'password': 'load-test'}
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request('POST', '/auth/register', urlencode(form), headers)
+    conn.getresponse().read()
+    conn.request('POST', '/auth/login', urlencode(form), headers)
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+
+    cookie = response.getheader('Set-Cookie')
+    if not cookie:
+        raise SystemExit('Login failed; is the server running with a database?')
+    return cookie.split(';', 1)[0]
+
+
+def multipart(pdf, text):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="text"\r\n\r\n{text}\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="load.pdf"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'
+    ).encode() + pdf + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+async def read_response(reader, chunk, delay):
+    """Read one HTTP/1.1 response chunk by chunk; returns (status, body size)."""
+    status_line = await reader.readline()
+    status = int(status_line.split()[1]) if status_line else 0
+    length = None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+
+    received = 0
+    while length is None or received < length:
+        data = await reader.read(chunk)
+        if not data:
+            break
+        received += len(data)
+        await asyncio.sleep(delay)
+    return status, received
+
+
+async def slow_client(host, port, cookie, body, content_type, chunk, delay, results):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write((
+            f'POST /pdf/watermark HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n'
+            f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'
+        ).encode())
+        for offset in range(0, len(body), chunk):
+            writer.write(body[offset:offset + chunk])
+            await writer.drain()
+            await asyncio.sleep(delay)
+        status, size = await read_response(reader, chunk, delay)
+        writer.close()
+        results.append((status, size, time.perf_counter() - start))
+    except Exception as e:
+        results.append((repr(e), 0, time.perf_counter() - start))
+
+
+async def probe(host, port, cookie, stop, latencies):
+    """Time quick requests on fresh connections until told to stop."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write((
+                f'GET /pdf/storage HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n'
+                f'Connection: close\r\n\r\n'
+            ).encode())
+            await writer.drain()
+            await read_response(reader, 65536, 0)
+            writer.close()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            latencies.append(float('inf'))
+        await asyncio.sleep(0.2)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+async def main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    cookie = login(host, port)
+    body, content_type = multipart(make_pdf(args.pages), 'load test')
+
+    results, latencies = [], []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(host, port, cookie, stop, latencies))
+
+    start = time.perf_counter()
+    clients = []
+    for _ in range(args.clients):
+        clients.append(asyncio.create_task(
+            slow_client(host, port, cookie, body, content_type, args.chunk, args.delay, results)
+        ))
+        await asyncio.sleep(args.ramp / args.clients)
+    await asyncio.gather(*clients)
+    stop.set()
+    await probe_task
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r[0] == 200]
+    durations = [r[2] for r in ok]
+    print(f"slow clients: {len(ok)}/{len(results)} succeeded in {elapsed:.1f}s")
+    if durations:
+        print(f"  transfer time p50={statistics.median(durations):.2f}s max={max(durations):.2f}s")
+    failures = {}
+    for r in results:
+        if r[0] != 200:
+            failures[r[0]] = failures.get(r[0], 0) + 1
+    if failures:
+        print(f"  failures: {failures}")
+    print(f"probe requests: {len(latencies)}")
+    print(f"  latency p50={percentile(latencies, 50) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 99) * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=500, help='concurrent slow clients')
+    parser.add_argument('--chunk', type=int, default=512, help='bytes sent/read per step')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds between steps')
+    parser.add_argument('--ramp', type=float, default=2.0, help='seconds to open all connections')
+    parser.add_argument('--pages', type=int, default=3, help='pages in the uploaded PDF')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""Bring an existing database up to date with the models.
+
+db.create_all() creates missing tables but never alters a table that is
+already there, so a deployment whose database predates a schema change
+must run this once after upgrading, before starting the app. Every step
+checks the live schema first, so it is safe to run again.
+
+    DATABASE_URL=postgresql://... python scripts/migrate_db.py
+"""
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The reaper queries the new columns, so keep it off until they exist
+os.environ['STORAGE_REAPER_INTERVAL'] = '0'
+
+from sqlalchemy import inspect, text, select, func
+from sqlalchemy.schema import CreateIndex
+from app import create_app, db
+
+logger = logging.getLogger('migrate_db')
+
+# Columns added to tables that already existed: (table, column)
+COLUMNS = [
+    ('pdf_file', 'input_size'),
+    ('pdf_file', 'output_size'),
+    ('pdf_file', 'storage_path'),
+    ('pdf_file', 'last_accessed'),
+]
+
+# Indexes declared on the models for tables that already existed
+INDEXES = [
+    'ix_pdf_file_user_created',
+    'ix_user_email_lower',
+    'ix_pdf_file_stored_user',
+    'ix_pdf_file_stored_accessed',
+]
+
+
+def add_columns(connection):
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    added = 0
+    for table_name, column_name in COLUMNS:
+        existing = {column['name'] for column in inspector.get_columns(table_name)}
+        if column_name in existing:
+            continue
+        column = db.metadata.tables[table_name].c[column_name]
+        connection.execute(text(
+            f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {preparer.quote(column_name)} "
+            f"{column.type.compile(dialect=connection.dialect)}"
+        ))
+        logger.info(f"Added column {table_name}.{column_name}")
+        added += 1
+    return added
+
+
+def create_indexes(connection):
+    # Expression indexes such as lower(email) can't be reflected on every
+    # backend, so rely on IF NOT EXISTS rather than inspecting first
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in INDEXES:
+        connection.execute(CreateIndex(indexes[name], if_not_exists=True))
+        logger.info(f"Index {name} is in place")
+
+
+def backfill_usage(connection):
+    """Seed an empty usage_daily from the operation history it summarizes,
+    so today's counts and daily limits carry over the upgrade."""
+    from models import PDFFile, UsageDaily
+    usage, files = UsageDaily.__table__, PDFFile.__table__
+    if connection.execute(select(func.count()).select_from(usage)).scalar():
+        return 0
+
+    day = func.date(files.c.created_at)
+    operation_type = func.coalesce(files.c.operation_type, 'unknown')
+    rows = select(
+        files.c.user_id,
+        day,
+        operation_type,
+        func.count(),
+        func.coalesce(func.sum(files.c.input_size), 0),
+        func.coalesce(func.sum(files.c.output_size), 0)
+    ).where(files.c.created_at.isnot(None)).group_by(files.c.user_id, day, operation_type)
+    result = connection.execute(usage.insert().from_select(
+        ['user_id', 'day', 'operation_type', 'operations', 'input_bytes', 'output_bytes'], rows
+    ))
+    logger.info(f"Backfilled {result.rowcount} usage_daily rows")
+    return result.rowcount
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        with db.engine.begin() as connection:
+            added = add_columns(connection)
+            create_indexes(connection)
+            backfilled = backfill_usage(connection)
+        logger.info(f"Migration complete: {added} columns added, {backfilled} usage rows backfilled")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class AuthBusy(Exception):
+    pass
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class PasswordHasher:
+    """Runs password hashing on a small dedicated pool.
+
+    Hashing is deliberately expensive, so it is capped at AUTH_HASH_WORKERS
+    concurrent jobs with at most AUTH_HASH_QUEUE more waiting; past that
+    AuthBusy is raised instead of letting a login burst take every CPU away
+    from PDF requests. hashlib releases the GIL, so threads are enough.
+    """
+
+    def __init__(self, app=None):
+        self.method = None
+        self._executor = None
+        self._slots = None
+        self._dummy_hash = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        workers = app.config['AUTH_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + app.config['AUTH_HASH_QUEUE'])
+
+        # The prefix werkzeug writes for the current method and cost, e.g.
+        # 'scrypt:32768:8:1'; stored hashes with another prefix get upgraded.
+        self._dummy_hash = generate_password_hash('dummy-password', method=self.method)
+        self.prefix = self._dummy_hash.split('$', 1)[0]
+        app.extensions['password_hasher'] = self
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusy('Too many password checks in progress')
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check a password; with no stored hash, burn the same time and fail
+        so unknown emails can't be told apart by response time."""
+        if not pwhash:
+            self._run(check_password_hash, self._dummy_hash, password)
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return not pwhash or pwhash.split('$', 1)[0] != self.prefix
+
+
+class LoginThrottle:
+    """Per-IP sliding window of failed logins, kept in memory.
+
+    At most AUTH_THROTTLE_MAX_IPS addresses are tracked; the least recently
+    seen are forgotten first. A successful login does not clear an address's
+    failures, they only age out, so logging into an account of one's own
+    doesn't reset the limit.
+    """
+
+    def __init__(self, app=None):
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_failures = app.config['AUTH_MAX_FAILURES']
+        self.window = app.config['AUTH_FAILURE_WINDOW']
+        self.max_ips = app.config['AUTH_THROTTLE_MAX_IPS']
+        app.extensions['login_throttle'] = self
+
+    def _recent(self, ip, now):
+        failures = self._failures.get(ip)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[ip]
+            return None
+        return failures
+
+    def is_blocked(self, ip):
+        with self._lock:
+            failures = self._recent(ip, time.monotonic())
+            return failures is not None and len(failures) >= self.max_failures
+
+    def record_failure(self, ip):
+        now = time.monotonic()
+        with self._lock:
+            failures = self._recent(ip, now)
+            if failures is None:
+                failures = self._failures[ip] = deque(maxlen=self.max_failures)
+            failures.append(now)
+            self._failures.move_to_end(ip)
+            while len(self._failures) > self.max_ips:
+                self._failures.popitem(last=False)
+        if len(failures) >= self.max_failures:
+            logger.warning(f"Login throttled for {ip}")
+
+
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
@@ -154,10 +154,18 @@ class PDFDropzone {
 
         const formData = new FormData();
 
-        if (operation === 'merge') {
+        const batch = this.currentFiles.length > 1 && ['split', 'watermark', 'rotate', 'compress'].includes(operation);
+
+        if (operation === 'merge' || batch) {
             this.currentFiles.forEach(file => formData.append('files[]', file));
-        } else {
-            formData.append('file', this.currentFiles[0]);
+        }
+        if (batch) {
+            formData.append('operation', operation);
+        }
+        if (operation !== 'merge') {
+            if (!batch) {
+                formData.append('file', this.currentFiles[0]);
+            }
 
             if (operation === 'split') {
                 const pageRanges = document.getElementById('page-ranges').value;
@@ -186,7 +194,7 @@ class PDFDropzone {
         this.updateProgressBar(0);
 
         try {
-            const response = await fetch(`/pdf/${operation}`, {
+            const response = await fetch(`/pdf/${batch ? 'batch' : operation}`, {
                 method: 'POST',
                 body: formData
             });
@@ -199,7 +207,7 @@ class PDFDropzone {
             const url = window.URL.createObjectURL(blob);
             const a = document.createElement('a');
             a.href = url;
-            a.download = `${operation}_result.pdf`;
+            a.download = batch ? `batch_${operation}.zip` : `${operation}_result.pdf`;
             document.body.appendChild(a);
             a.click();
             a.remove();
@@ -5,6 +5,9 @@ class PDFOperations {
         this.fileInput = document.getElementById('file-input');
         this.fileList = document.getElementById('file-list');
         this.progressBar = document.querySelector('.progress-bar');
+        this.previewContainer = document.getElementById('page-previews');
+        this.previewFile = null;
+        this.previewObserver = null;
         this.files = [];
 
         this.initializeDropZone();
@@ -84,6 +87,84 @@ class PDFOperations {
             this.fileList.appendChild(fileItem);
         });
         feather.replace();
+        this.loadPreviews();
+    }
+
+    async loadPreviews() {
+        if (!this.previewContainer) return;
+
+        const file = this.files[0] || null;
+        if (file === this.previewFile) return;
+        this.previewFile = file;
+
+        if (this.previewObserver) {
+            this.previewObserver.disconnect();
+            this.previewObserver = null;
+        }
+        this.previewContainer.innerHTML = '';
+        this.previewContainer.classList.toggle('d-none', !file);
+        if (!file) return;
+
+        // Roughly how many thumbnails fit on screen; the server prefetches the rest
+        const visible = Math.max(1, Math.ceil(this.previewContainer.clientWidth / 132));
+        const formData = new FormData();
+        formData.append('file', file);
+        formData.append('visible', visible);
+
+        let preview;
+        try {
+            const response = await fetch('/pdf/preview', { method: 'POST', body: formData });
+            if (!response.ok) throw new Error('Preview failed');
+            preview = await response.json();
+        } catch (error) {
+            console.error('Preview error:', error);
+            this.previewContainer.classList.add('d-none');
+            return;
+        }
+
+        // The user may have changed the selection while we were uploading
+        if (file !== this.previewFile) return;
+
+        const images = [];
+        for (let page = 1; page <= preview.pages; page++) {
+            const item = document.createElement('figure');
+            item.className = 'page-preview m-0';
+            const img = document.createElement('img');
+            img.alt = `Page ${page}`;
+            img.dataset.src = `/pdf/preview/${preview.doc}/${page}.png?w=${preview.width}`;
+            const caption = document.createElement('figcaption');
+            caption.textContent = page;
+            item.appendChild(img);
+            item.appendChild(caption);
+            this.previewContainer.appendChild(item);
+            images.push(img);
+        }
+
+        const show = (img) => {
+            if (!img.src) img.src = img.dataset.src;
+        };
+
+        // Pages on screen load first, as soon as they scroll into view
+        this.previewObserver = new IntersectionObserver((entries) => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) show(entry.target);
+            });
+        }, { root: this.previewContainer });
+        images.forEach(img => this.previewObserver.observe(img));
+
+        // Then fill in the rest one at a time while the browser is idle
+        const idle = window.requestIdleCallback || ((cb) => setTimeout(cb, 200));
+        let next = 0;
+        const loadNext = () => {
+            if (file !== this.previewFile) return;
+            while (next < images.length && images[next].src) next++;
+            if (next >= images.length) return;
+            const img = images[next++];
+            img.addEventListener('load', () => idle(loadNext), { once: true });
+            img.addEventListener('error', () => idle(loadNext), { once: true });
+            show(img);
+        };
+        idle(loadNext);
     }
 
     removeFile(index) {
@@ -225,8 +306,18 @@ class PDFOperations {
                     break;
             }
 
+            // Several files for a per-file operation go to the batch endpoint,
+            // which processes them in parallel and returns a ZIP
+            let endpoint = operation;
+            if (this.files.length > 1 && ['split', 'watermark', 'rotate'].includes(operation)) {
+                formData.delete('file');
+                this.files.forEach(file => formData.append('files[]', file));
+                formData.append('operation', operation);
+                endpoint = 'batch';
+            }
+
             this.updateProgress(20);
-            const response = await fetch(`/pdf/${operation}`, {
+            const response = await fetch(`/pdf/${endpoint}`, {
                 method: 'POST',
                 body: formData
             });
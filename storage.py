@@ -0,0 +1,239 @@
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from models import PDFFile
+
+logger = logging.getLogger(__name__)
+
+
+class StorageQuotaExceeded(Exception):
+    pass
+
+
+class StorageManager:
+    """Keeps operation results on disk under STORAGE_ROOT and enforces quotas.
+
+    Every stored artifact is backed by a PDFFile row whose storage_path,
+    output_size and last_accessed columns drive the accounting, so usage
+    figures come from the database rather than from walking the filesystem.
+    Caches that keep other files under STORAGE_ROOT register themselves
+    with register_cache; they count towards the same quotas and are evicted
+    before stored results.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+        self._caches = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        os.makedirs(app.config['STORAGE_ROOT'], exist_ok=True)
+        app.extensions['storage'] = self
+
+        if app.config.get('STORAGE_REAPER_INTERVAL'):
+            self.start_reaper()
+
+    def register_cache(self, cache):
+        """Track a cache providing usage(user_id=None),
+        evict(nbytes, user_id=None) -> bytes freed, and rebuild(), which the
+        reaper calls to resync its totals after removing stray files."""
+        if cache not in self._caches:
+            self._caches.append(cache)
+
+    # Accounting
+
+    def _stored(self):
+        return PDFFile.query.filter(PDFFile.storage_path.isnot(None))
+
+    def usage(self, user_id=None):
+        query = db.session.query(func.coalesce(func.sum(PDFFile.output_size), 0)).filter(
+            PDFFile.storage_path.isnot(None)
+        )
+        if user_id is not None:
+            query = query.filter(PDFFile.user_id == user_id)
+        return int(query.scalar()) + sum(cache.usage(user_id) for cache in self._caches)
+
+    def usage_by_user(self):
+        rows = db.session.query(
+            PDFFile.user_id,
+            func.count(PDFFile.id),
+            func.coalesce(func.sum(PDFFile.output_size), 0)
+        ).filter(PDFFile.storage_path.isnot(None)).group_by(PDFFile.user_id).all()
+        return {user_id: {'files': files, 'bytes': int(size)} for user_id, files, size in rows}
+
+    # Storing and retrieving
+
+    def store(self, pdf_file, data):
+        """Write data to disk for pdf_file, evicting older artifacts if needed.
+
+        Raises StorageQuotaExceeded when the artifact alone is larger than the
+        per-user or global quota. The caller is responsible for committing.
+        """
+        size = len(data)
+        with self._lock:
+            self._make_room(pdf_file.user_id, size)
+
+            user_dir = os.path.join(self.app.config['STORAGE_ROOT'], str(pdf_file.user_id))
+            os.makedirs(user_dir, exist_ok=True)
+            path = os.path.join(user_dir, f"{uuid.uuid4().hex}_{os.path.basename(pdf_file.filename)}")
+            tmp_path = path + '.part'
+            with open(tmp_path, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+
+        pdf_file.storage_path = path
+        pdf_file.output_size = size
+        pdf_file.last_accessed = datetime.utcnow()
+        return path
+
+    def reserve(self, user_id, size):
+        """Make room for size bytes that a registered cache is about to write
+        for user_id. Raises StorageQuotaExceeded if they can never fit."""
+        with self._lock:
+            self._make_room(user_id, size)
+
+    def _make_room(self, user_id, size):
+        user_quota = self.app.config['STORAGE_USER_QUOTA']
+        global_quota = self.app.config['STORAGE_GLOBAL_QUOTA']
+        if size > user_quota or size > global_quota:
+            raise StorageQuotaExceeded(f"{size} bytes exceeds the storage quota")
+        self._evict(user_quota - size, user_id=user_id)
+        self._evict(global_quota - size)
+
+    def touch(self, pdf_file):
+        """Mark an artifact as recently used and return its path, or None if gone."""
+        if not pdf_file.storage_path or not os.path.exists(pdf_file.storage_path):
+            pdf_file.storage_path = None
+            db.session.commit()
+            return None
+        pdf_file.last_accessed = datetime.utcnow()
+        db.session.commit()
+        return pdf_file.storage_path
+
+    def discard(self, pdf_file):
+        if pdf_file.storage_path:
+            try:
+                os.remove(pdf_file.storage_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Could not remove {pdf_file.storage_path}: {str(e)}")
+                return False
+        pdf_file.storage_path = None
+        return True
+
+    def _evict(self, limit, user_id=None):
+        """Drop least recently used artifacts until usage is at or below limit."""
+        used = self.usage(user_id)
+        if used <= limit:
+            return 0
+
+        # Cached previews are cheaper to lose than results, so they go first
+        for cache in self._caches:
+            if used <= limit:
+                break
+            used -= cache.evict(used - limit, user_id)
+
+        query = self._stored()
+        if user_id is not None:
+            query = query.filter(PDFFile.user_id == user_id)
+
+        evicted = 0
+        for pdf_file in query.order_by(PDFFile.last_accessed.asc(), PDFFile.id.asc()):
+            if used <= limit:
+                break
+            size = pdf_file.output_size or 0
+            if self.discard(pdf_file):
+                used -= size
+                evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} stored results (user={user_id})")
+        return evicted
+
+    # Reaper
+
+    def reap(self):
+        """Expire artifacts by TTL, enforce the global quota and prune old history."""
+        now = datetime.utcnow()
+        stats = {'expired': 0, 'evicted': 0, 'orphans': 0, 'history': 0}
+        ttl = timedelta(seconds=self.app.config['STORAGE_TTL'])
+
+        with self._lock:
+            expired = self._stored().filter(
+                func.coalesce(PDFFile.last_accessed, PDFFile.created_at) < now - ttl
+            ).all()
+            for pdf_file in expired:
+                if self.discard(pdf_file):
+                    stats['expired'] += 1
+
+            stats['evicted'] = self._evict(self.app.config['STORAGE_GLOBAL_QUOTA'])
+
+            retention_days = self.app.config.get('STORAGE_HISTORY_RETENTION_DAYS')
+            if retention_days:
+                old_rows = PDFFile.query.filter(
+                    PDFFile.created_at < now - timedelta(days=retention_days)
+                ).all()
+                for pdf_file in old_rows:
+                    self.discard(pdf_file)
+                    db.session.delete(pdf_file)
+                stats['history'] = len(old_rows)
+
+            db.session.commit()
+            stats['orphans'] = self._sweep_orphans(now - ttl)
+            for cache in self._caches:
+                cache.rebuild()
+
+        logger.info(f"Storage reaper: {stats}")
+        return stats
+
+    def _sweep_orphans(self, cutoff):
+        """Remove files under STORAGE_ROOT that no PDFFile row points at."""
+        known = {path for (path,) in db.session.query(PDFFile.storage_path).filter(
+            PDFFile.storage_path.isnot(None))}
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.app.config['STORAGE_ROOT']):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path in known:
+                    continue
+                try:
+                    if datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def start_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._run_reaper, name='storage-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._stop.set()
+
+    def _run_reaper(self):
+        interval = self.app.config['STORAGE_REAPER_INTERVAL']
+        while not self._stop.wait(interval):
+            with self.app.app_context():
+                try:
+                    self.reap()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Storage reaper error: {str(e)}")
+                finally:
+                    db.session.remove()
+
+
+storage = StorageManager()
@@ -0,0 +1,337 @@
+import io
+import os
+import hashlib
+import logging
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
+from PyPDF2 import PdfReader
+from storage import storage
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Fall back to placeholder previews
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# Widths are snapped to this step so clients can't fill the cache with
+# one entry per pixel.
+WIDTH_STEP = 40
+MIN_WIDTH = 80
+MAX_WIDTH = 400
+
+# PDFium is not thread-safe: every call into it, from request threads and
+# the prefetch pool alike, has to hold this lock.
+_pdfium_lock = threading.Lock()
+
+
+def snap_width(width):
+    width = max(MIN_WIDTH, min(MAX_WIDTH, int(width)))
+    return width - width % WIDTH_STEP
+
+
+class PageRenderer:
+    """An open document that any number of pages can be rendered from,
+    so rendering several pages only reads and parses the PDF once."""
+
+    def __init__(self, data):
+        self._document = None
+        self._reader = None
+        if pdfium is not None:
+            with _pdfium_lock:
+                self._document = pdfium.PdfDocument(data)
+        else:
+            self._reader = PdfReader(io.BytesIO(data))
+
+    def __len__(self):
+        if self._document is not None:
+            with _pdfium_lock:
+                return len(self._document)
+        return len(self._reader.pages)
+
+    def render(self, page_index, width):
+        """Render one page to PNG bytes at the given pixel width."""
+        if page_index >= len(self):
+            raise IndexError('page index out of range')
+        if self._document is not None:
+            with _pdfium_lock:
+                page = self._document[page_index]
+                bitmap = page.render(scale=width / page.get_width())
+                # to_pil shares the bitmap's buffer, so copy before closing
+                image = bitmap.to_pil().convert('RGB')
+                bitmap.close()
+                page.close()
+        else:
+            image = render_placeholder(self._reader.pages[page_index], page_index, width)
+
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    def close(self):
+        if self._document is not None:
+            with _pdfium_lock:
+                self._document.close()
+            self._document = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render_page(data, page_index, width):
+    """Render a single page of a PDF to PNG bytes at the given pixel width."""
+    with PageRenderer(data) as renderer:
+        return renderer.render(page_index, width)
+
+
+def render_placeholder(page, page_index, width):
+    """Draw a blank page with the right aspect ratio and its page number."""
+    box = page.mediabox
+    page_width, page_height = float(box.width), float(box.height)
+    if (page.get('/Rotate') or 0) % 180:
+        page_width, page_height = page_height, page_width
+
+    height = max(1, int(width * page_height / page_width))
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, width - 1, height - 1], outline='#cccccc')
+    draw.text((width // 2 - 6, height // 2 - 6), str(page_index + 1), fill='#666666')
+    return image
+
+
+class ThumbnailCache:
+    """Two-tier cache for page previews: a byte-bounded LRU in memory backed
+    by PNG files on disk, both keyed by (user, document hash, page, width).
+
+    Source documents are kept on disk next to their thumbnails so previews
+    can be rendered on demand after a single upload. Everything lives under
+    STORAGE_ROOT and counts towards the storage quotas: the storage manager
+    evicts least recently used previews before stored results, and its
+    reaper expires them with other unreferenced files once they are older
+    than STORAGE_TTL. Disk use is kept as running totals so quota checks
+    never walk the tree; the reaper calls rebuild() to resync them.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._disk_lock = threading.Lock()
+        self._documents = {}  # (user id, hash) -> [last used, bytes on disk]
+        self._user_bytes = {}
+        self._total_bytes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.root = os.path.join(app.config['STORAGE_ROOT'], 'thumbnails')
+        os.makedirs(self.root, exist_ok=True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config['THUMBNAIL_WORKERS'],
+            thread_name_prefix='thumbnails'
+        )
+        self.rebuild()
+        storage.register_cache(self)
+        app.extensions['thumbnails'] = self
+
+    def _doc_dir(self, user_id, doc_hash):
+        return os.path.join(self.root, str(user_id), doc_hash)
+
+    def _source_path(self, user_id, doc_hash):
+        return os.path.join(self._doc_dir(user_id, doc_hash), 'source.pdf')
+
+    def add_document(self, user_id, data):
+        """Keep a copy of the document and return (hash, page count).
+
+        Raises ValueError if data is not a readable PDF and
+        StorageQuotaExceeded if there is no room for it.
+        """
+        try:
+            page_count = len(PdfReader(io.BytesIO(data)).pages)
+        except Exception as e:
+            raise ValueError(f"Not a readable PDF: {str(e)}")
+
+        doc_hash = hashlib.sha256(data).hexdigest()
+        path = self._source_path(user_id, doc_hash)
+        if not os.path.exists(path):
+            storage.reserve(user_id, len(data))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{threading.get_ident()}.part'
+            with open(tmp_path, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+            self._account(user_id, doc_hash, len(data))
+        else:
+            os.utime(path)
+            self._account(user_id, doc_hash, 0)
+        return doc_hash, page_count
+
+    def has_document(self, user_id, doc_hash):
+        return os.path.exists(self._source_path(user_id, doc_hash))
+
+    def _png_path(self, user_id, doc_hash, page_index, width):
+        return os.path.join(self._doc_dir(user_id, doc_hash), f'{page_index}_{width}.png')
+
+    def _cached(self, key, path):
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+                return png
+        if os.path.exists(path):
+            with open(path, 'rb') as fh:
+                png = fh.read()
+            os.utime(path)
+            self._account(key[0], key[1], 0)
+            self._remember(key, png)
+            return png
+        return None
+
+    def _save(self, key, path, png):
+        tmp_path = f'{path}.{threading.get_ident()}.part'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(png)
+        try:
+            replaced = os.path.getsize(path)  # Another thread rendered it too
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        self._account(key[0], key[1], len(png) - replaced)
+        self._remember(key, png)
+
+    def _read_source(self, user_id, doc_hash):
+        with open(self._source_path(user_id, doc_hash), 'rb') as fh:
+            return fh.read()
+
+    def get(self, user_id, doc_hash, page_index, width):
+        """Return PNG bytes for a page, rendering and caching on a miss."""
+        key = (user_id, doc_hash, page_index, width)
+        path = self._png_path(user_id, doc_hash, page_index, width)
+        png = self._cached(key, path)
+        if png is None:
+            png = render_page(self._read_source(user_id, doc_hash), page_index, width)
+            self._save(key, path, png)
+        return png
+
+    def _remember(self, key, png):
+        limit = self.app.config['THUMBNAIL_MEMORY_CACHE']
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = png
+            self._memory_bytes += len(png)
+            while self._memory_bytes > limit and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def prefetch(self, user_id, doc_hash, pages, width):
+        """Render up to THUMBNAIL_PREFETCH_PAGES pages in the background, in
+        the order given, from a single open copy of the document."""
+        pages = list(pages)[:self.app.config['THUMBNAIL_PREFETCH_PAGES']]
+
+        def run():
+            renderer = None
+            try:
+                for page_index in pages:
+                    key = (user_id, doc_hash, page_index, width)
+                    path = self._png_path(user_id, doc_hash, page_index, width)
+                    if self._cached(key, path) is not None:
+                        continue
+                    if renderer is None:
+                        renderer = PageRenderer(self._read_source(user_id, doc_hash))
+                    self._save(key, path, renderer.render(page_index, width))
+            except Exception as e:
+                logger.error(f"Thumbnail prefetch error: {str(e)}")
+            finally:
+                if renderer is not None:
+                    renderer.close()
+        self._executor.submit(run)
+
+    # Storage accounting
+
+    def _account(self, user_id, doc_hash, nbytes):
+        """Record nbytes more on disk for a document and mark it used."""
+        user = str(user_id)
+        with self._disk_lock:
+            entry = self._documents.setdefault((user, doc_hash), [0, 0])
+            entry[0] = time.time()
+            entry[1] += nbytes
+            self._user_bytes[user] = self._user_bytes.get(user, 0) + nbytes
+            self._total_bytes += nbytes
+
+    def rebuild(self):
+        """Recount disk use from the files under the cache root. This walks
+        the whole tree, so it only runs at startup and from the reaper."""
+        documents, user_bytes, total = {}, {}, 0
+        for user in _listdir(self.root):
+            for doc_hash in _listdir(os.path.join(self.root, user)):
+                last_used, size = 0, 0
+                doc_dir = os.path.join(self.root, user, doc_hash)
+                for name in _listdir(doc_dir):
+                    try:
+                        stat = os.stat(os.path.join(doc_dir, name))
+                    except OSError:
+                        continue
+                    last_used = max(last_used, stat.st_mtime)
+                    size += stat.st_size
+                documents[(user, doc_hash)] = [last_used, size]
+                user_bytes[user] = user_bytes.get(user, 0) + size
+                total += size
+        with self._disk_lock:
+            self._documents, self._user_bytes, self._total_bytes = documents, user_bytes, total
+
+    def usage(self, user_id=None):
+        with self._disk_lock:
+            if user_id is None:
+                return self._total_bytes
+            return self._user_bytes.get(str(user_id), 0)
+
+    def evict(self, nbytes, user_id=None):
+        """Delete least recently used documents with their thumbnails until
+        at least nbytes are freed. Returns the bytes freed."""
+        if self.app is None:
+            return 0
+        with self._disk_lock:
+            candidates = sorted(
+                (last_used, size, user, doc_hash)
+                for (user, doc_hash), (last_used, size) in self._documents.items()
+                if user_id is None or user == str(user_id)
+            )
+
+        freed = 0
+        for _, size, user, doc_hash in candidates:
+            if freed >= nbytes:
+                break
+            shutil.rmtree(os.path.join(self.root, user, doc_hash), ignore_errors=True)
+            with self._disk_lock:
+                entry = self._documents.pop((user, doc_hash), None)
+                if entry is not None:
+                    self._user_bytes[user] = self._user_bytes.get(user, 0) - entry[1]
+                    self._total_bytes -= entry[1]
+            with self._lock:
+                for key in [key for key in self._memory if str(key[0]) == user and key[1] == doc_hash]:
+                    self._memory_bytes -= len(self._memory.pop(key))
+            freed += size
+        if freed:
+            logger.info(f"Evicted {freed} bytes of previews (user={user_id})")
+        return freed
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+thumbnails = ThumbnailCache()